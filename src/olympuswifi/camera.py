@@ -1,12 +1,27 @@
-import datetime, os, sys, time
-
-import xml.etree.ElementTree as ElementTree
+import asyncio, datetime, functools, hashlib, io, json, os, socket, sys, time
+
+try:
+    from lxml import etree as ElementTree # optional, faster XML parser
+    # Drop comments and processing instructions like xml.etree does.
+    ITERPARSE_OPTIONS = { 'remove_comments': True, 'remove_pis': True }
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+    ITERPARSE_OPTIONS = {}
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass   # needs Python 3.7 or later
 from enum import Enum
 from threading import Semaphore
-from typing import List, Dict, Optional, Set, Union
+from typing import Callable, Iterator, List, Dict, Optional, Set, Union
+from xml.sax.saxutils import escape
 
 import requests # on Ubuntu install with "apt install -y python3-requests"
+from urllib3.connection import HTTPConnection # installed with requests
+
+_MISSING = object() # dict.get() default; None is a valid argument value
+
+# Zero-padded strings for the fields of DOS dates and times.
+_DOS_YEARS = tuple(str(1980+year) for year in range(128))
+_TWO_DIGITS = tuple(f'{number:02d}' for number in range(64))
 
 
 ###############################################################################
@@ -37,6 +52,34 @@ class ResultError(Exception):
         self.response = response
 
 
+###############################################################################
+# Class _KeepAliveAdapter enables TCP keep-alive for camera connections.      #
+###############################################################################
+
+class _KeepAliveAdapter(requests.adapters.HTTPAdapter):
+    """
+    Transport adapter that adds *SO_KEEPALIVE* to urllib3's default socket
+    options, which already disable Nagle's algorithm with *TCP_NODELAY*.
+    Where available, *TCP_KEEPIDLE*, *TCP_KEEPINTVL*, and *TCP_KEEPCNT*
+    shorten the operating system's defaults (2 hours idle before the first
+    probe on Linux): a connection that has been silent for 30 seconds is
+    probed every 10 seconds and closed after 3 unanswered probes.
+    """
+    KEEPALIVE_OPTIONS = (('TCP_KEEPIDLE', 30), ('TCP_KEEPINTVL', 10),
+                         ('TCP_KEEPCNT', 3))
+    "Keep-alive idle time and probe interval in seconds, and probe count"
+    SOCKET_OPTIONS = HTTPConnection.default_socket_options + [
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    ] + [
+        (socket.IPPROTO_TCP, getattr(socket, name), value)
+        for name, value in KEEPALIVE_OPTIONS if hasattr(socket, name)
+    ]
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.setdefault('socket_options', self.SOCKET_OPTIONS)
+        super().init_poolmanager(*args, **kwargs)
+
+
 ###############################################################################
 # Class OlympusCamera communicates with an Olympus camera via wifi. It needs  #
 # to run on a computer that is connected to the camera's wifi network.        #
@@ -63,14 +106,18 @@ class OlympusCamera:
     @dataclass
     class CmdDescr:
         "Description of a single camera command."
+        __slots__ = ('method', 'args', 'url')
         method: str
         "HTTP-method *get* or *post*"
         args  : Dict[str, Optional[dict]]
         "nested dicts of command's key-value argument pairs"
+        url   : str
+        "URL of command, example 'http://192.168.0.10/get_caminfo.cgi'"
 
     @dataclass
     class FileDescr:
         "This class describes an image file available for download."
+        __slots__ = ('file_name', 'file_size', 'date_time')
         file_name: str
         "example '/DCIM/100OLYMP/P1010042.JPG'"
         file_size: int
@@ -97,38 +144,71 @@ class OlympusCamera:
     """
     Headers to send when communicating with camera.
     """
+    XML_POST_HEADERS    = { 'Content-Type': 'text/plain;charset=utf-8' }
+    """
+    Additional headers to send when posting XML data to camera.
+    """
+    SET_VALUE_XML       = (b'<?xml version="1.0"?>\r\n<set>\r\n<value>',
+                           b'</value>\r\n</set>\r\n')
+    """
+    Prefix and suffix of XML data posted by *set_camprop*.
+    """
+    XML_MAGIC           = b'<?xml '
+    """
+    Posted data that starts with these bytes is sent as XML.
+    """
 
     ANY_PARAMETER                               = '*'
     EMPTY_PARAMETERS: Dict[str, Optional[dict]] = { ANY_PARAMETER: None }
     DEFAULT_PORT = 40000
     DEFAULT_RES = "0640x0480"
+    MAX_WORKERS = 4
+    "Maximal number of concurrent requests sent to the camera"
+    MAX_VALID_COMMANDS = 256
+    "Maximal number of validated (command, args) pairs remembered"
+    CHUNK_SIZE = 65536
+    "Number of bytes read at a time when images are streamed to files"
+    CACHE_DIR: Optional[str] = os.path.join(os.environ.get('XDG_CACHE_HOME',
+                                          os.path.expanduser('~/.cache')),
+                                          'olympuswifi')
+    """
+    Directory for cached command lists; set to *None* to disable the cache.
+    """
 
     def __init__(self):
+        self._session = requests.Session()  # reused for keep-alive
+        self._session.headers.update(self.HEADERS)
+        self._image_url_prefix = self.URL_PREFIX[:-1]  # without trailing '/'
+        # Image listing and downloads may each use MAX_WORKERS connections.
+        self._session.mount('http://', _KeepAliveAdapter(
+                            pool_connections=1,
+                            pool_maxsize=2 * self.MAX_WORKERS))
         self.versions: Dict[str, str] = {}  # version data
         self.supported: Set[str] = set()    # supported functionality
         self.camera_info = None             # includes camera model
         self._camera_status = OlympusCamera.CamStatus(self.CamMode.UNKNOWN, False, False, self.DEFAULT_RES, self.DEFAULT_PORT, Semaphore())
         self.commands: Dict[str, CmdDescr] = {
-            'get_commandlist': self.CmdDescr('get', None)
+            'get_commandlist': self.CmdDescr('get', None,
+                                     self.command_url('get_commandlist'))
         }
+        # (command, args) pairs that passed check_valid_command()
+        self._valid_commands: Set[tuple] = set()
+        # Camera properties are queried on first use of camprop_name2values.
+        self._camprop_name2values: Optional[Dict[str, List[str]]] = None
 
         response = self.send_command('get_commandlist')
         if response is None:
             return
 
-        # Parse XML command description and populate members
-        # self.versions, self.supported, and self.commands.
-        for elem in ElementTree.fromstring(response.text):
-            if elem.tag == 'cgi':
-                for http_method in elem:
-                    if http_method.tag == 'http_method':
-                        self.commands[elem.attrib['name']] = \
-                            self.CmdDescr(http_method.attrib['type'],
-                                          self.commandlist_cmds(http_method))
-            elif elem.tag == 'support':
-                self. supported.add(elem.attrib['func'])
-            elif 'version' in elem.tag:
-                self.versions[elem.tag] = elem.text.strip()
+        # The parsed command list is cached on disk, keyed by a hash of the
+        # command list. On a cache hit the command list is not parsed.
+        # Camera properties depend on lens and mode; they are queried on
+        # first use and not cached on disk.
+        cache_file = self._cache_file(response.content)
+        cached = self._load_cache(cache_file)
+        if not cached:
+            self._parse_commandlist(response.content)
+            self._save_cache(cache_file)
 
         # Issue get-camera-info command. It returns the camera model.
         info = self.xml_query('get_caminfo')
@@ -138,41 +218,192 @@ class OlympusCamera:
         else:
             self.camera_info = info
 
-        # Get lists of supported values for writable camera properties.
-        self.send_command('switch_cammode', mode='rec')
-        self.camprop_name2values = {
-            prop['propname'] : prop['enum'].split() for prop in
-            self.xml_query('get_camprop', com='desc', propname='desclist')
-            if prop['attribute'] == 'getset' and 'enum' in prop
-        }
-
         # Switch to mode 'play'.
         self._switch_cammode(self.CamMode.PLAY)
 
+    def _parse_commandlist(self, xml: bytes) -> None:
+        """
+        Stream-parse XML command description and populate members
+        self.versions, self.supported, and self.commands. Children of
+        the root element are processed when complete and then removed
+        from the root element.
+
+        :param xml: response of command 'get_commandlist'
+        :type xml: *bytes*
+        """
+        depth = 0
+        root = None
+        for event, elem in ElementTree.iterparse(io.BytesIO(xml),
+                                                 events=('start', 'end'),
+                                                 **ITERPARSE_OPTIONS):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            if elem.tag == 'cgi':
+                for http_method in elem:
+                    if http_method.tag == 'http_method':
+                        name = sys.intern(elem.attrib['name'])
+                        self.commands[name] = \
+                            self.CmdDescr(http_method.attrib['type'],
+                                          self.commandlist_cmds(http_method),
+                                          self.command_url(name))
+            elif elem.tag == 'support':
+                self.supported.add(elem.attrib['func'])
+            elif elem.tag.endswith('version'):
+                self.versions[elem.tag] = elem.text.strip()
+            root.clear()
+
+    def _cache_file(self, xml: bytes) -> Optional[str]:
+        """
+        Return name of cache file for a command list or *None* if caching
+        is disabled.
+
+        :param xml: response of command 'get_commandlist'
+        :type xml: *bytes*
+        """
+        if self.CACHE_DIR is None:
+            return None
+        return os.path.join(self.CACHE_DIR,
+                            hashlib.sha1(xml).hexdigest() + '.json')
+
+    def _load_cache(self, cache_file: Optional[str]) -> bool:
+        """
+        Populate members self.versions, self.supported, and self.commands
+        from cache file; return *True* on success.
+
+        :param cache_file: name of cache file or *None*
+        :type cache_file: *str*
+        """
+        if cache_file is None:
+            return False
+        try:
+            with open(cache_file, 'rt', encoding='utf-8') as f:
+                cache = json.load(f, object_pairs_hook=lambda pairs:
+                                  { sys.intern(key): value
+                                    for key, value in pairs })
+            commands = { name: self.CmdDescr(method, args,
+                                             self.command_url(name))
+                         for name, (method, args) in cache['commands'].items() }
+            versions = cache['versions']
+            supported = set(cache['supported'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        self.commands = commands
+        self.versions = versions
+        self.supported = supported
+        return True
+
+    def _save_cache(self, cache_file: Optional[str]) -> None:
+        """
+        Write members self.versions, self.supported, and self.commands to
+        cache file. Errors are ignored.
+
+        :param cache_file: name of cache file or *None*
+        :type cache_file: *str*
+        """
+        if cache_file is None:
+            return
+        cache = {
+            'commands': { name: [cmd.method, cmd.args]
+                          for name, cmd in self.commands.items() },
+            'versions': self.versions,
+            'supported': sorted(self.supported),
+        }
+        tmp_file = f'{cache_file}.{os.getpid()}'
+        try:
+            os.makedirs(self.CACHE_DIR, exist_ok=True)
+            with open(tmp_file, 'wt', encoding='utf-8') as f:
+                json.dump(cache, f)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+
+    def command_url(self, command: str) -> str:
+        "Return the URL for camera command *command*."
+        return f'{self.URL_PREFIX}{command}.cgi'
+
+    def image_url(self, dir: str) -> str:
+        """
+        Return the URL for image *dir* on the camera; *dir* starts with '/'.
+        """
+        return self._image_url_prefix + dir
+
+    def close(self) -> None:
+        """
+        Close the HTTP connections to the camera.
+        """
+        self._session.close()
+
+    def __enter__(self) -> 'OlympusCamera':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
     def commandlist_params(self, parent: ElementTree.Element) \
                                                    -> Dict[str, Optional[dict]]:
         "Parse parameters in the XML output of command get_commandlist."
-        params = {}
-        for param in parent:
-            if param.tag.startswith('cmd'):
-                return { self.ANY_PARAMETER: { param.attrib['name'].strip():
-                                                 self.commandlist_params(param)
-                                             }
-                       }
-            else:
-                name = param.attrib['name'].strip() if 'name' in param.attrib \
-                                                    else self.ANY_PARAMETER
-                params[name] = self.commandlist_cmds(param)
-        return params if len(params) else self.EMPTY_PARAMETERS
+        return self._commandlist_tree(parent, is_cmds=False)
 
     def commandlist_cmds(self, parent: ElementTree.Element) \
                                          -> Optional[Dict[str, Optional[dict]]]:
         "Parse commands in the XML output of command get_commandlist."
-        cmds: Dict[str, Optional[dict]] = {}
-        for cmd in parent:
-            assert cmd.tag.startswith('cmd')
-            cmds[cmd.attrib['name'].strip()] = self.commandlist_params(cmd)
-        return cmds if cmds else None
+        return self._commandlist_tree(parent, is_cmds=True)
+
+    def _commandlist_tree(self, parent: ElementTree.Element,
+                          is_cmds: bool) -> Optional[Dict[str, Optional[dict]]]:
+        """
+        Parse the nested commands and parameters below *parent* without
+        recursion. Tags alternate between cmd<n> and param<n> by level.
+
+        :param parent: element whose children are to be parsed
+        :type parent: *ElementTree.Element*
+        :param is_cmds: are the children of *parent* commands or parameters
+        :type is_cmds: *bool*
+        """
+        # Each entry is an element, whether its children are commands, and
+        # the dict and key where its parsed value is stored.
+        result: Dict[Optional[str], Optional[dict]] = {}
+        stack: list = [(parent, is_cmds, result, None)]
+        while stack:
+            elem, is_cmds, container, key = stack.pop()
+            children = []
+            value: Optional[dict]
+            if is_cmds:
+                value = {}
+                for cmd in elem:
+                    assert cmd.tag.startswith('cmd')
+                    children.append((cmd, False, value,
+                                     sys.intern(cmd.attrib['name'].strip())))
+                if not children:
+                    value = None
+            else:
+                value = {}
+                for param in elem:
+                    if param.tag.startswith('cmd'):
+                        value = { self.ANY_PARAMETER: {} }
+                        children = [(param, False, value[self.ANY_PARAMETER],
+                                     sys.intern(param.attrib['name'].strip()))]
+                        break
+                    name = sys.intern(param.attrib['name'].strip()) \
+                           if 'name' in param.attrib else self.ANY_PARAMETER
+                    children.append((param, True, value, name))
+                if not children:
+                    value = self.EMPTY_PARAMETERS
+            container[key] = value
+            # Keep key order; with duplicate names the last one wins.
+            for _, _, child_container, child_key in children:
+                child_container[child_key] = None
+            stack.extend(reversed(children))
+        return result[None]
 
     def send_command(self, command: str, **args) -> requests.Response:
         """
@@ -186,23 +417,23 @@ class OlympusCamera:
         # Check command and args against what the camera supports.
         self.check_valid_command(command, args)
 
-        url = f'{self.URL_PREFIX}{command}.cgi'
-        if self.commands[command].method == 'get':
-            response = requests.get(url, headers=self.HEADERS, params=args)
+        cmd_descr = self.commands[command]
+        url = cmd_descr.url
+        if cmd_descr.method == 'get':
+            response = self._session.get(url, params=args)
         else:
-            assert self.commands[command].method == 'post'
+            assert cmd_descr.method == 'post'
             if 'post_data' in args:
                 post_data = args['post_data']
                 del args['post_data']
             else:
                 raise RequestError(f"Error in '{command}' with args "
-                          f"'{', '.join([k+'='+v for k, v in args.items()])}': "
+                          f"'{', '.join([f'{k}={v}' for k, v in args.items()])}': "
                           "missing entry 'post_data' for method 'post'.")
-            headers = self.HEADERS.copy()
-            if len(post_data) > 6 and post_data[:6] == "<?xml ".encode('utf-8'):
-                headers['Content-Type'] = 'text/plain;charset=utf-8'
-            response = requests.post(url, headers=headers, params=args,
-                                     data=post_data)
+            headers = self.XML_POST_HEADERS \
+                      if post_data.startswith(self.XML_MAGIC) else None
+            response = self._session.post(url, headers=headers, params=args,
+                                          data=post_data)
 
         if response.status_code in [requests.codes.ok, requests.codes.accepted]:
             return response
@@ -249,6 +480,23 @@ class OlympusCamera:
         if self._camera_status.liveview_restart and not self._camera_status.liveview_active:
             self.start_liveview(self._camera_status.liveview_port, self._camera_status.liveview_lvqty)
 
+    def switch_cammode(self, cammode: CamMode) -> None:
+        """
+        Switch the camera to mode of operation *cammode*. Waits for a command
+        running in another thread to complete.
+
+        :param cammode: new mode of operation
+        :type cammode: *CamMode*
+        :raises: raises *RequestError* if the camera is busy
+        """
+        if not self._camera_status.execution_lock.acquire(timeout=10):
+            raise RequestError(f"Error: camera busy; cannot switch to mode "
+                               f"'{cammode.value}'.")
+        try:
+            self._switch_cammode(cammode)
+        finally:
+            self._camera_status.execution_lock.release()
+
 
     # Check validity of command and arguments.
     def check_valid_command(self, command: str,
@@ -263,19 +511,28 @@ class OlympusCamera:
         :raises: raises *RequestError* if not a valid camera command
         """
 
+        # Has this command with these arguments been checked before? The
+        # post data itself is not part of the key, only its type.
+        cache_key = (command, tuple((k, type(v)) if k == 'post_data'
+                                    else (k, v) for k, v in args.items()))
+        if cache_key in self._valid_commands:
+            return
+
         # Check command.
-        if command not in self.commands:
+        cmd_descr = self.commands.get(command)
+        if cmd_descr is None:
             raise RequestError(f"Error: command '{command}' not supported; "
                                "valid commands: "
                                f"{', '.join(list(self.commands))}.")
 
-        valid_command_arguments = self.commands[command].args
+        valid_command_arguments = cmd_descr.args
+        is_post = cmd_descr.method == 'post'
 
         # Check command arguments.
         wildcard = self.ANY_PARAMETER
         for key, value in args.items():
 
-            if key == 'post_data' and self.commands[command].method == 'post':
+            if is_post and key == 'post_data':
                 if not isinstance(value, bytes):
                     raise RequestError(f"Error in {command}: data for method "
                                        f"'post' is of type '{type(value)}'; "
@@ -288,24 +545,28 @@ class OlympusCamera:
                                    f"{key}={value} not supported.")
 
             # Is key a valid argument?
-            if key in valid_command_arguments:
-                valid_command_arguments = valid_command_arguments[key]
-            elif wildcard in valid_command_arguments:
-                valid_command_arguments = valid_command_arguments[wildcard]
-            else:
-                raise RequestError(f"Error in {command}: '{key}' in "
-                                   f"{key}={value} not supported; supported: "
+            arguments = valid_command_arguments.get(key, _MISSING)
+            if arguments is _MISSING:
+                arguments = valid_command_arguments.get(wildcard, _MISSING)
+                if arguments is _MISSING:
+                    raise RequestError(f"Error in {command}: '{key}' in "
+                                       f"{key}={value} not supported; supported: "
                                  f"{', '.join(list(valid_command_arguments))}.")
+            valid_command_arguments = arguments
 
             # Is value valid for key?
-            if value in valid_command_arguments:
-                valid_command_arguments = valid_command_arguments[value]
-            elif wildcard in valid_command_arguments:
-                valid_command_arguments = valid_command_arguments[wildcard]
-            else:
-                raise RequestError(f"Error in {command}: '{value}' in "
-                                   f"{key}={value} not supported; supported: "
+            arguments = valid_command_arguments.get(value, _MISSING)
+            if arguments is _MISSING:
+                arguments = valid_command_arguments.get(wildcard, _MISSING)
+                if arguments is _MISSING:
+                    raise RequestError(f"Error in {command}: '{value}' in "
+                                       f"{key}={value} not supported; supported: "
                   f"{', '.join([key+'='+v for v in valid_command_arguments])}.")
+            valid_command_arguments = arguments
+
+        if len(self._valid_commands) >= self.MAX_VALID_COMMANDS:
+            self._valid_commands.clear()
+        self._valid_commands.add(cache_key)
 
     def get_versions(self) -> Dict[str, str]:
         """
@@ -331,8 +592,9 @@ class OlympusCamera:
         """
         Return the camera model.
         """
-        model = self.get_camera_info().get('model')
-        return 'unknown model' if model is None else model
+        info = self.camera_info
+        model = info.get('model') if info else None
+        return model if model else 'unknown model'
 
     def get_commands(self) -> Dict[str, CmdDescr]:
         """
@@ -343,9 +605,39 @@ class OlympusCamera:
         """
         return self.commands
 
+    @property
+    def camprop_name2values(self) -> Dict[str, List[str]]:
+        """
+        Dict of writable camera properties and lists of their supported
+        values. It is queried from the camera on first use and then kept for
+        the lifetime of this instance; the supported values depend on the
+        mounted lens and the shooting mode. The camera is switched back to
+        its previous mode after the query.
+
+        :raises: raises *RequestError* if the camera is busy
+        """
+        if self._camprop_name2values is None:
+            cammode = self._camera_status.cammode_current
+            if not self._action_begin(self.CamMode.RECORD):
+                raise RequestError("Error: camera busy; cannot query "
+                                   "supported camera property values.")
+            try:
+                desclist = self.xml_query('get_camprop', com='desc',
+                                          propname='desclist')
+            finally:
+                self._switch_cammode(cammode)
+                self._action_end()
+            self._camprop_name2values = {
+                prop['propname'] : prop['enum'].split() for prop in desclist
+                if prop['attribute'] == 'getset' and 'enum' in prop
+            }
+        return self._camprop_name2values
+
     def get_settable_propnames_and_values(self) -> Dict[str, List[str]]:
         """
         Return dict of camera properties and list of their supported values.
+
+        :raises: raises *RequestError* if the camera is busy
         """
         return self.camprop_name2values
 
@@ -385,20 +677,39 @@ class OlympusCamera:
         :param value: value for *propname*
         :type value: *str*
         :raises: raises *RequestError* if not a valid camera property or value
+                 or if the supported values cannot be queried
         """
-        if propname in self.camprop_name2values and \
-           value not in self.camprop_name2values[propname]:
-            all_values = ', '.join([v for v in
-                                    self.camprop_name2values[propname]])
-            raise RequestError(f"Error: value '{value}' not supported for "
-                               f"camera property '{propname}'; supported "
-                               f"values: {all_values}.")
+        self.set_camprops({ propname: value })
+
+    def set_camprops(self, propname2value: Dict[str, str]) -> None:
+        """
+        Set the values of several camera properties. All values are checked
+        before the first one is set and the camera switches mode only once.
+
+        :param propname2value: dict of supported property names and values
+        :type propname2value: *Dict[str, str]*
+        :raises: raises *RequestError* if not a valid camera property or value
+                 or if the supported values cannot be queried
+        """
+        # Raises RequestError rather than skipping the checks.
+        camprop_name2values = self.camprop_name2values
+        for propname, value in propname2value.items():
+            supported_values = camprop_name2values.get(propname)
+            if supported_values is not None and value not in supported_values:
+                raise RequestError(f"Error: value '{value}' not supported for "
+                                   f"camera property '{propname}'; supported "
+                                   f"values: {', '.join(supported_values)}.")
+        prefix, suffix = self.SET_VALUE_XML
         if self._action_begin(self.CamMode.RECORD):
-            set_value_xml = '<?xml version="1.0"?>\r\n<set>\r\n' \
-                           f'<value>{value}</value>\r\n</set>\r\n'
-            self.send_command('set_camprop', com='set', propname=propname,
-                              post_data=set_value_xml.encode('utf-8'))
-            self._action_end()
+            try:
+                for propname, value in propname2value.items():
+                    self.send_command('set_camprop', com='set',
+                                      propname=propname,
+                                      post_data=prefix +
+                                            escape(value).encode('utf-8') +
+                                            suffix)
+            finally:
+                self._action_end()
 
     def xml_response(self, response: requests.Response) -> \
                           Optional[Union[Dict[str, str], List[Dict[str, str]]]]:
@@ -409,11 +720,27 @@ class OlympusCamera:
         :type response: *requests.Response*
         :returns: *Dict[str,str]*, *List[Dict[str,str]]*, or *None*
         """
-        if 'Content-Type' in response.headers and \
-           response.headers['Content-Type'] == 'text/xml':
-            xml = ElementTree.fromstring(response.text)
+        if response.headers.get('Content-Type') == 'text/xml':
+            # Stream-parse XML. Each open element has a pair of a dict for
+            # its leaf children and a list of dicts from its other children.
             my_dict: Dict[str, str] = {}
-            my_list: List[Dict[str, str]] = self.xml2dict(xml, my_dict)
+            my_list: List[Dict[str, str]] = []
+            stack = [(my_dict, my_list)]
+            for event, elem in ElementTree.iterparse(
+                                              io.BytesIO(response.content),
+                                              events=('start', 'end'),
+                                              **ITERPARSE_OPTIONS):
+                if event == 'start':
+                    stack.append(({}, []))
+                    continue
+                params, results = stack.pop()
+                if elem.text and elem.text.strip():
+                    stack[-1][0][sys.intern(elem.tag)] = elem.text.strip()
+                else:
+                    if params:
+                        results.append(params)
+                    stack[-1][1].extend(results)
+                elem.clear()
             if not my_list:
                 return my_dict
             return my_list[0] if len(my_list) == 1 else my_list
@@ -422,7 +749,8 @@ class OlympusCamera:
     def xml2dict(self, xml: ElementTree.Element,
                  parent: Dict[str, str])  -> List[Dict[str, str]]:
         """
-        Recursively traverse XML and return a list of dicts.
+        Traverse XML and return a list of dicts. Leaf elements are entered
+        into the dict of their parent element.
 
         :param xml: XML element
         :type xml: * ElementTree.Element*
@@ -430,17 +758,30 @@ class OlympusCamera:
         :type parent: *Dict[str, str]*
         :returns: *Dict[str,str]* or *List[Dict[str,str]]*
         """
-        if xml.text and xml.text.strip():
-            parent[xml.tag] = xml.text.strip()
+        text = xml.text
+        if text and text.strip():
+            parent[sys.intern(xml.tag)] = text.strip()
             return []
-        else:
-            results = []
-            params: Dict[str, str] = {}
-            for elem in xml:
-                results += self.xml2dict(elem, params)
-            if params:
-                results.append(params)
-            return results
+
+        # Explicit stack of (children iterator, leaf dict, results list).
+        results: List[Dict[str, str]] = []
+        stack = [(iter(xml), {}, results)]
+        while stack:
+            children, params, child_results = stack[-1]
+            for elem in children:
+                text = elem.text
+                if text and text.strip():
+                    params[sys.intern(elem.tag)] = text.strip()
+                else:
+                    stack.append((iter(elem), {}, []))
+                    break
+            else:
+                stack.pop()
+                if params:
+                    child_results.append(params)
+                if stack:
+                    stack[-1][2].extend(child_results)
+        return results
 
     def xml_query(self, command: str, **args) -> \
                           Optional[Union[Dict[str, str], List[Dict[str, str]]]]:
@@ -465,9 +806,13 @@ class OlympusCamera:
                               diff=time.strftime("%z"))
             self._action_end()
 
-    def take_picture(self) -> None:
+    def take_picture(self, settle: float = 0.5) -> None:
         """
         The camera takes a picture.
+
+        :param settle: seconds to wait for the camera to settle before and
+                       after pushing the shutter in shutter mode, default 0.5
+        :type settle: *float*
         """
         if 'shutter' not in self.commands['switch_cammode'].args['mode']:
             # Camera does not support shutter mode; use record mode.
@@ -482,12 +827,91 @@ class OlympusCamera:
         else:
             # Camera supports shutter mode.
             if self._action_begin(self.CamMode.SHUTTER):
-                time.sleep(0.5)
+                time.sleep(settle)
                 self.send_command('exec_shutter', com='1st2ndpush')
-                time.sleep(0.5)
+                time.sleep(settle)
                 self.send_command('exec_shutter', com='2nd1strelease')
                 self._action_end()
 
+    async def take_picture_async(self, settle: float = 0.5) -> None:
+        """
+        The camera takes a picture; coroutine version of *take_picture*. The
+        camera is controlled from a worker thread so that the event loop
+        keeps running while the camera settles.
+
+        :param settle: seconds to wait for the camera to settle before and
+                       after pushing the shutter in shutter mode, default 0.5
+        :type settle: *float*
+        """
+        await self._run_async(self.take_picture, settle)
+
+    async def send_command_async(self, command: str,
+                                 **args) -> requests.Response:
+        """
+        Coroutine version of *send_command*.
+
+        :param command: camera command
+        :type command: *str*
+        :param args: dict of command arguments
+        :type args: *Dict[str,CmdDescr]*
+        """
+        return await self._run_async(self.send_command, command, **args)
+
+    async def list_images_async(self,
+                                dir: str = '/DCIM') -> List[FileDescr]:
+        """
+        Coroutine version of *list_images*.
+
+        :param dir: camera's image directory, default '/DCIM'
+        :type dir: *str*
+        :returns: list of instances of class *FileDescr*
+        """
+        return await self._run_async(self.list_images, dir)
+
+    async def download_thumbnail_async(self, dir: str) -> bytes:
+        """
+        Coroutine version of *download_thumbnail*.
+
+        :param dir: path to image on camera
+        :type dir: *str*
+        :returns: JPEG image
+        """
+        return await self._run_async(self.download_thumbnail, dir)
+
+    async def download_image_async(self, dir: str) -> bytes:
+        """
+        Coroutine version of *download_image*.
+
+        :param dir: path to image on camera
+        :type dir: *str*
+        :returns: JPEG image
+        """
+        return await self._run_async(self.download_image, dir)
+
+    async def download_image_to_async(self, dir: str, local_file: str,
+                                      exclusive: bool = False) -> Optional[int]:
+        """
+        Coroutine version of *download_image_to*.
+
+        :param dir: path to image on camera
+        :type dir: *str*
+        :param local_file: name of local file to write
+        :type local_file: *str*
+        :param exclusive: raise *FileExistsError* instead of overwriting an existing *local_file*
+        :type exclusive: *bool*
+        :returns: number of bytes written or *None* if the camera returned an error
+        """
+        return await self._run_async(self.download_image_to, dir, local_file,
+                                     exclusive)
+
+    async def _run_async(self, func: Callable, *args, **kwargs):
+        """
+        Run *func* in the running event loop's default executor; used by the
+        coroutine versions of the blocking methods.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+                                   None, functools.partial(func, *args, **kwargs))
+
     def list_images(self, dir: str = '/DCIM') -> List[FileDescr]:
         """
         Return list of instances of class FileDescr for a given directory
@@ -497,35 +921,87 @@ class OlympusCamera:
         :type dir: *str*
         :returns: list of instances of class *FileDescr*
         """
+        return list(self.iter_images(dir))
+
+    def iter_images(self, dir: str = '/DCIM') -> Iterator[FileDescr]:
+        """
+        Generate instances of class FileDescr for a given directory and all
+        its subdirectories on the camera memory card. Subdirectories are
+        queried concurrently; images are generated in listing order with
+        the images of each subdirectory in place of that subdirectory.
+
+        :param dir: camera's image directory, default '/DCIM'
+        :type dir: *str*
+        :returns: iterator over instances of class *FileDescr*
+        """
+        with ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as executor:
+            def listing(entries: List[Union[OlympusCamera.FileDescr, str]]):
+                # All subdirectories are submitted before the first one
+                # is consumed.
+                return (iter(entries),
+                        iter([executor.submit(self.list_directory, entry)
+                              for entry in entries if isinstance(entry, str)]))
+
+            # Explicit stack of (entries, subdirectory listings) pairs; the
+            # top pair is the directory whose entries are being generated.
+            stack = [listing(self.list_directory(dir))]
+            while stack:
+                entries, subdir_listings = stack[-1]
+                for entry in entries:
+                    if isinstance(entry, str):
+                        stack.append(listing(next(subdir_listings).result()))
+                        break
+                    yield entry
+                else:
+                    stack.pop()
+
+    def list_directory(self, dir: str) -> List[Union[FileDescr, str]]:
+        """
+        Return list of instances of class FileDescr and paths of
+        subdirectories, in listing order, for a single directory on the
+        camera memory card.
+
+        :param dir: camera's image directory
+        :type dir: *str*
+        :returns: list of *FileDescr* for images and *str* for subdirectories
+        """
         try:
             result = self.send_command('get_imglist', DIR=dir)
         except ResultError as e:
             if e.response.status_code == 404: # camera returns error 404
                 return []                     # for an empty directory
             raise
-        images = []
-        for line in result.text.split('\r\n'):
-            components = line.split(',')
+        entries: List[Union[FileDescr, str]] = []
+        FileDescr = self.FileDescr
+        # The listing is plain ASCII; it is split as bytes and only the
+        # path is decoded. Numeric fields are converted by int() directly.
+        for line in result.content.splitlines():
+            components = line.split(b',', 5)
             if len(components) != 6:
                 continue
-            path = '/'.join(components[:2])
-            size, attrib, date, time = [int(cmp) for cmp in components[2:]]
-            datetime = f'{1980+(date>>9)}-{(date>>5)&15:02d}-{date&31:02d}'\
-                       f'T{time>>11:02d}:{(time>>5)&63:02d}:{2*(time&31):02d}'
-            if attrib & 2: # hidden
-                print(f"Ignoring hidden file '{path}'.")
-                continue
-            if attrib & 4: # system
-                print(f"Ignoring system file '{path}'.")
-                continue
-            if attrib & 8: # volume
-                print(f"Ignoring volume '{path}'.")
+            dir_name, file_name, size_s, attrib_s, date_s, time_s = components
+            path = (dir_name + b'/' + file_name).decode('latin-1')
+            attrib = int(attrib_s)
+            if attrib & 14: # hidden, system, or volume; rarely set
+                if attrib & 2: # hidden
+                    print(f"Ignoring hidden file '{path}'.")
+                elif attrib & 4: # system
+                    print(f"Ignoring system file '{path}'.")
+                else: # volume
+                    print(f"Ignoring volume '{path}'.")
                 continue
             if attrib & 16: # directory
-                images += self.list_images(path)
+                entries.append(path)
             else:
-                images.append(self.FileDescr(path, size, datetime))
-        return images
+                date, tim = int(date_s), int(time_s) & 0xffff
+                date_time = _DOS_YEARS[(date>>9)&127] + '-' + \
+                            _TWO_DIGITS[(date>>5)&15] + '-' + \
+                            _TWO_DIGITS[date&31] + 'T' + \
+                            _TWO_DIGITS[tim>>11] + ':' + \
+                            _TWO_DIGITS[(tim>>5)&63] + ':' + \
+                            _TWO_DIGITS[2*(tim&31)]
+                entries.append(FileDescr(path, int(size_s), date_time))
+        return entries
 
     def download_thumbnail(self, dir: str) -> bytes:
         """
@@ -545,8 +1021,65 @@ class OlympusCamera:
         :type dir: *str*
         :returns: JPEG image
         """
-        return requests.get(self.URL_PREFIX + dir[1:],
-                            headers=self.HEADERS).content
+        return self._session.get(self.image_url(dir)).content
+
+    def download_image_to(self, dir: str, local_file: str,
+                          exclusive: bool = False) -> Optional[int]:
+        """
+        Writes full-size jpeg image to a local file. The image is streamed to
+        the file in chunks of *CHUNK_SIZE* bytes and not held in memory.
+
+        :param dir: path to image on camera
+        :type dir: *str*
+        :param local_file: name of local file to write
+        :type local_file: *str*
+        :param exclusive: raise *FileExistsError* instead of overwriting an existing *local_file*
+        :type exclusive: *bool*
+        :returns: number of bytes written or *None* if the camera returned an error
+        """
+        size = 0
+        with self._session.get(self.image_url(dir), stream=True) as response:
+            if response.status_code != requests.codes.ok:
+                return None
+            with open(local_file, 'xb' if exclusive else 'wb') as f:
+                for chunk in response.iter_content(chunk_size=self.CHUNK_SIZE):
+                    f.write(chunk)
+                    size += len(chunk)
+        return size
+
+    def download_thumbnails(self, dirs: List[str],
+                            max_workers: Optional[int] = None) -> List[bytes]:
+        """
+        Returns thumbnail jpeg images; they are downloaded concurrently.
+
+        :param dirs: paths to images on camera
+        :type dirs: *List[str]*
+        :param max_workers: number of concurrent downloads, default *MAX_WORKERS*
+        :type max_workers: *int*
+        :returns: list of JPEG images in the order of *dirs*
+        """
+        return self._download_batch(self.download_thumbnail, dirs, max_workers)
+
+    def download_images(self, dirs: List[str],
+                        max_workers: Optional[int] = None) -> List[bytes]:
+        """
+        Returns full-size jpeg images; they are downloaded concurrently.
+
+        :param dirs: paths to images on camera
+        :type dirs: *List[str]*
+        :param max_workers: number of concurrent downloads, default *MAX_WORKERS*
+        :type max_workers: *int*
+        :returns: list of JPEG images in the order of *dirs*
+        """
+        return self._download_batch(self.download_image, dirs, max_workers)
+
+    def _download_batch(self, download: Callable[[str], bytes],
+                        dirs: List[str],
+                        max_workers: Optional[int]) -> List[bytes]:
+        "Call *download* for each of *dirs* on a thread pool."
+        with ThreadPoolExecutor(max_workers=max_workers or
+                                            self.MAX_WORKERS) as executor:
+            return list(executor.map(download, dirs))
 
     def start_liveview(self, port: int, lvqty: str) -> List[str]:
         """
@@ -567,10 +1100,10 @@ class OlympusCamera:
             self._camera_status.liveview_lvqty = lvqty
             self._camera_status.liveview_port = port
             xml = self.send_command('exec_takemisc', com='startliveview',
-                                    port=port).text
+                                    port=port).content
             self._camera_status.liveview_active = True
             self._action_end()
-            if xml and xml.startswith("<?xml "):
+            if xml and xml.startswith(b"<?xml "):
                 return [funcid.attrib['name']
                         for funcid in ElementTree.fromstring(xml)
                         if funcid.tag == 'funcid' and 'name' in funcid.attrib]
@@ -596,5 +1129,5 @@ class OlympusCamera:
         """
         model = self.get_camera_model()
         versions = ', '.join([f'{key} {value}' for key, value in
-                              self.get_versions().items()])
+                              self.versions.items()])
         print(f"Connected to Olympus {model}, {versions}.")
@@ -1,4 +1,7 @@
-import argparse, datetime, os, sys
+import argparse, datetime, os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
 from .camera import OlympusCamera
 
 
@@ -6,76 +9,141 @@ from .camera import OlympusCamera
 #    Function download_photos() downloads photos from the Olympus camera.    #
 ##############################################################################
 
-def download_photos(camera: OlympusCamera, output_dir: str) -> None:
+def download_photos(camera: OlympusCamera, output_dir: str,
+                    max_workers: Optional[int] = None) -> None:
     """
     Function download_photos() downloads photos from the Olympus camera.
+    Several photos are downloaded concurrently.
 
     :param output_dir: local directory to write downloaded camera images to
     :type output_dir: *str*
+    :param max_workers: number of concurrent downloads, default *camera.MAX_WORKERS*
+    :type max_workers: *int*
     :returns: nothing; warnings are written to *stdout*
     """
-    for cam_file in camera.list_images():
-        local_dir = os.path.join(os.path.expanduser('~'), 'Pictures',
-                                 cam_file.date_time[:4]) if output_dir is None\
-                                                         else output_dir
-
-        # Create output directory if it does not exist.
-        if not os.path.exists(local_dir):
-            try:
-                os.makedirs(local_dir)
-            except Exception as e:
-                print(f"Cannot create directory '{local_dir}': {str(e)}.")
-                break
-
-        # Local filename to open and write to.
-        local_file = os.path.join(local_dir, cam_file.file_name.split('/')[-1])
-
-        # Local filename used in in messages.
-        msg_file = local_file.replace(os.path.expanduser('~'), '~')
-
-        # Turn time into datetime object.
-        dt = datetime.datetime.strptime(cam_file.date_time, '%Y-%m-%dT%H:%M:%S')
-
-        # Time in seconds since epoch.
-        tim_epoch = dt.timestamp()
-
-        # Skip image download if local file already exists.
-        if os.path.exists(local_file):
-            stat = os.stat(local_file)
-            if stat.st_size == cam_file.file_size and \
-                   abs(tim_epoch - stat.st_mtime) < 10:
-                print(f"File '{msg_file}' exists; skipping download.")
-            elif stat.st_size != cam_file.file_size:
-                print(f"File '{msg_file}' exists and size differs; "
-                      "skipping download.")
-            else:
-                print(f"File '{msg_file}' exists and modification time differs;"
-                      " skipping download.")
-            continue
-
-        # Download image.
-        image = camera.download_image(cam_file.file_name)
-        if image is not None:
-            assert len(image) == cam_file.file_size
-
-            # Write image to local file.
-            try:
-                with open(local_file, 'wb') as f:
-                    f.write(image)
-            except Exception as e:
-                print(f"Failed to download '{cam_file.file_name}' to "
-                      f"'{msg_file}': {str(e)}.")
+    futures = []
+    home = os.path.expanduser('~')
+    pictures_dir = os.path.join(home, 'Pictures')
+
+    # Stat results of files in local directories, read once per directory;
+    # None for files being downloaded in this run.
+    existing: Dict[str, Dict[str, Optional[os.stat_result]]] = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers or
+                                        camera.MAX_WORKERS) as executor:
+        for cam_file in camera.iter_images():
+            local_dir = os.path.join(pictures_dir, cam_file.date_time[:4]) \
+                        if output_dir is None else output_dir
+
+            if local_dir not in existing:
+                # Create output directory if it does not exist.
+                try:
+                    os.makedirs(local_dir, exist_ok=True)
+                except Exception as e:
+                    print(f"Cannot create directory '{local_dir}': "
+                          f"{str(e)}.")
+                    break
+                local_stats = {}
                 try:
-                    os.remove(local_file)
-                except:
-                    pass
+                    with os.scandir(local_dir) as entries:
+                        for entry in entries:
+                            try:
+                                local_stats[entry.name] = entry.stat()
+                            except OSError:
+                                pass # e.g. dangling symlink; open() decides
+                except OSError as e:
+                    print(f"Cannot read directory '{local_dir}': "
+                          f"{str(e)}.")
+                    break
+                existing[local_dir] = local_stats
+            local_stats = existing[local_dir]
+
+            # Local filename to open and write to.
+            base_name = cam_file.file_name.split('/')[-1]
+            local_file = os.path.join(local_dir, base_name)
+
+            # Local filename used in in messages.
+            msg_file = local_file.replace(home, '~')
+
+            # Turn time into datetime object.
+            dt = datetime.datetime.fromisoformat(cam_file.date_time)
+
+            # Time in seconds since epoch.
+            tim_epoch = dt.timestamp()
+
+            # Skip image download if local file already exists.
+            stat = local_stats.get(base_name)
+            if stat is not None:
+                if stat.st_size == cam_file.file_size and \
+                       abs(tim_epoch - stat.st_mtime) < 10:
+                    print(f"File '{msg_file}' exists; skipping download.")
+                elif stat.st_size != cam_file.file_size:
+                    print(f"File '{msg_file}' exists and size differs; "
+                          "skipping download.")
+                else:
+                    print(f"File '{msg_file}' exists and modification time "
+                          "differs; skipping download.")
+                continue
+            if base_name in local_stats:
+                print(f"File '{msg_file}' is already being downloaded; "
+                      "skipping download.")
                 continue
+            local_stats[base_name] = None
 
-            print(f"File '{cam_file.file_name}' of {cam_file.file_size:,} bytes"
-                  f" from {dt} downloaded to '{msg_file}'.")
+            futures.append(executor.submit(_download_photo, camera, cam_file,
+                                           local_file, msg_file, dt))
 
-            # Set local file's creation and modification time.
-            os.utime(local_file, (tim_epoch, tim_epoch))
+    # Re-raise exceptions from downloads.
+    for future in futures:
+        future.result()
+
+def _download_photo(camera: OlympusCamera, cam_file: OlympusCamera.FileDescr,
+                    local_file: str, msg_file: str,
+                    dt: datetime.datetime) -> None:
+    """
+    Download a single photo to a local file; runs in a worker thread.
+
+    :param camera: connection to Olympus camera
+    :type camera: *OlympusCamera*
+    :param cam_file: image on camera
+    :type cam_file: *OlympusCamera.FileDescr*
+    :param local_file: local file to write
+    :type local_file: *str*
+    :param msg_file: local file name used in messages
+    :type msg_file: *str*
+    :param dt: date and time of image
+    :type dt: *datetime.datetime*
+    """
+    # Stream image to local file; do not overwrite a file that another
+    # program has created since the directory was read.
+    try:
+        size = camera.download_image_to(cam_file.file_name, local_file,
+                                        exclusive=True)
+        if size is None:
+            print(f"Failed to download '{cam_file.file_name}': camera "
+                  "returned an error.")
+            return
+        if size != cam_file.file_size:
+            raise OSError(f"received {size:,} of {cam_file.file_size:,} "
+                          "bytes")
+    except FileExistsError:
+        print(f"File '{msg_file}' exists; skipping download.")
+        return
+    except Exception as e:
+        print(f"Failed to download '{cam_file.file_name}' to "
+              f"'{msg_file}': {str(e)}.")
+        try:
+            os.remove(local_file)
+        except:
+            pass
+        return
+
+    print(f"File '{cam_file.file_name}' of {cam_file.file_size:,} bytes"
+          f" from {dt} downloaded to '{msg_file}'.")
+
+    # Set local file's creation and modification time.
+    tim_epoch = dt.timestamp()
+    os.utime(local_file, (tim_epoch, tim_epoch))
 
 def main() -> None:
     """
@@ -93,21 +161,20 @@ def main() -> None:
 
     args = parser.parse_args()
 
-    # Connect to camera.
-    camera = OlympusCamera()
-
-    # Report camera model.
-    camera.report_model()
+    # Connect to camera; the connections are closed on exit.
+    with OlympusCamera() as camera:
+        # Report camera model.
+        camera.report_model()
 
-    # Set camera's clock if requested.
-    if args.set_clock:
-        camera.set_clock()
+        # Set camera's clock if requested.
+        if args.set_clock:
+            camera.set_clock()
 
-    download_photos(camera, args.output)
+        download_photos(camera, args.output)
 
-    # Turn camera off if requested.
-    if args.power_off:
-        camera.send_command('exec_pwoff')
+        # Turn camera off if requested.
+        if args.power_off:
+            camera.send_command('exec_pwoff')
 
 
 if __name__ == '__main__':
@@ -1,24 +1,158 @@
-import argparse, io, queue, socket, threading, tkinter
+import argparse, ctypes, functools, io, os, queue, select, socket, struct, sys, threading, tkinter
+from collections import deque
 from dataclasses import dataclass   # needs Python 3.7 or later
-from typing import Tuple, Optional
+from typing import List, Tuple, Optional
 
 from PIL import Image, ImageTk # on Ubuntu install with "apt install -y python3-pil"
 
 from .camera import OlympusCamera
 
 
+###########################################################################
+# class RecvMMsg receives several UDP datagrams with a single system call #
+# on Linux.                                                               #
+###########################################################################
+
+class _IOVec(ctypes.Structure):
+    "C struct iovec"
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+class _MsgHdr(ctypes.Structure):
+    "C struct msghdr"
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_IOVec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+class _MMsgHdr(ctypes.Structure):
+    "C struct mmsghdr"
+    _fields_ = [('msg_hdr', _MsgHdr),
+                ('msg_len', ctypes.c_uint)]
+
+class RecvMMsg:
+    """
+    Class *RecvMMsg* receives up to *count* UDP datagrams with a single
+    *recvmmsg* system call into a preallocated buffer. It is available on
+    Linux only; the constructor raises *OSError* on other systems.
+
+    :param sock: UDP socket
+    :type sock: *socket.socket*
+    :param count: maximal number of datagrams per call
+    :type count: *int*
+    :param size: maximal size of a datagram
+    :type size: *int*
+    """
+
+    def __init__(self, sock: socket.socket, count: int = 64,
+                 size: int = 4096):
+        if not sys.platform.startswith('linux'):
+            raise OSError("recvmmsg is only available on Linux")
+        try:
+            self.recvmmsg = ctypes.CDLL(None, use_errno=True).recvmmsg
+        except AttributeError as e:
+            raise OSError("recvmmsg not found in C library") from e
+        self.recvmmsg.restype = ctypes.c_int
+        self.recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint,
+                                  ctypes.c_int, ctypes.c_void_p]
+        self.sock = sock
+        self.count = count
+        self.size = size
+        self.buffer = bytearray(count * size)
+        self.view = memoryview(self.buffer)
+        base = ctypes.addressof((ctypes.c_char * len(self.buffer))
+                                .from_buffer(self.buffer))
+        self.iovecs = (_IOVec * count)()
+        self.msgs = (_MMsgHdr * count)()
+        for i in range(count):
+            self.iovecs[i].iov_base = base + i * size
+            self.iovecs[i].iov_len = size
+            self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            self.msgs[i].msg_hdr.msg_iovlen = 1
+
+    def receive(self) -> List[memoryview]:
+        """
+        Receive the queued datagrams, at least one; the socket must be
+        readable. The returned views into the buffer are valid until the
+        next call.
+
+        :returns: list of datagrams
+        """
+        n = self.recvmmsg(self.sock.fileno(), self.msgs, self.count,
+                          socket.MSG_DONTWAIT, None)
+        if n < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        size = self.size
+        return [self.view[i*size:i*size+self.msgs[i].msg_len]
+                for i in range(n)]
+
+
+###########################################################################
+# class FrameQueue passes frames from the receiver thread to the gui.     #
+###########################################################################
+
+class FrameQueue:
+    """
+    Class *FrameQueue* is a thread-safe queue of bounded length. When the
+    queue is full, *put* drops the oldest entry to make room.
+
+    :param maxlen: maximal number of entries
+    :type maxlen: *int*
+    """
+
+    def __init__(self, maxlen: int):
+        self.entries: deque = deque(maxlen=maxlen)
+        self.cond = threading.Condition()
+
+    def put(self, entry) -> None:
+        "Append *entry*, the oldest entry is dropped when the queue is full."
+        with self.cond:
+            self.entries.append(entry)
+            self.cond.notify()
+
+    def get(self, timeout: Optional[float] = None):
+        """
+        Remove and return the oldest entry, wait for one if needed.
+
+        :param timeout: maximal wait in seconds, *None* waits without limit
+        :type timeout: *float*
+        :raises queue.Empty: no entry arrived within *timeout* seconds
+        """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.entries, timeout):
+                raise queue.Empty
+            return self.entries.popleft()
+
+    def empty(self) -> bool:
+        "Return *True* if the queue is empty."
+        return not self.entries
+
+
 ###########################################################################
 # class LiveViewReceiver receives the camera's live view and enters it as #
 # sequence of jpeg images in a queue.                                     #
 ###########################################################################
 
+# Precompiled layouts of RTP headers: first two bytes and sequence number,
+# extension header length, and function id and length of extension entries.
+_RTP_HEADER = struct.Struct('>BBH')
+_RTP_EXTENSION_LENGTH = struct.Struct('>H')
+_RTP_EXTENSION_ENTRY = struct.Struct('>HH')
+
+# Transpositions that undo the camera's orientation, by EXIF orientation.
+_ROTATIONS = { 3: Image.ROTATE_180, 6: Image.ROTATE_270, 8: Image.ROTATE_90 }
+
 class LiveViewReceiver:
     """
     Class *LiveViewReceiver* receives the camera's live view and appends
     it as sequence of JPEG images to a queue.
 
     :param img_queue: instances of *JPEGandExtension* are appended to this queue
-    :type img_queue: *queue.SimpleQueue*
+    :type img_queue: *FrameQueue*
     """
 
     @dataclass
@@ -27,28 +161,41 @@ class LiveViewReceiver:
         This class stores a JPEG image and and RTP extension. Instances of
         this class are appended to the queue. 
         """
-        jpeg     : bytes
+        jpeg       : bytes
         "JPEG image"
-        extension: bytes
+        extension  : bytes
         "RTP extension"
+        orientation: Optional[int] = None
+        "orientation from RTP extension, see *get_orientation*"
 
     JPEG_START     = b'\xff\xd8'
     "JPEG images start with this magic number"
     JPEG_END       = b'\xff\xd9'
     "JPEG images end with this magic number"
-    MAX_QUEUE_SIZE = 50
-    "The queue will not contain more than this many entries"
+    MAX_QUEUE_SIZE = 1
+    "Length of the queue; older frames are dropped, the newest is shown"
+    RECV_BUFFER_SIZE = 12 * 1024 * 1024
+    "Requested size of the socket's receive buffer in bytes"
 
     # A queue is passed, JEPG images will be added to this queue.
-    def __init__(self, img_queue: queue.SimpleQueue):
+    def __init__(self, img_queue: FrameQueue):
         self.running = True
         self.img_queue = img_queue
+        # shut_down() writes to this socket pair to wake the receiver.
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
         self.prev_sequence_number = 0
+        # Consecutive frames usually carry the same extension.
+        self.prev_extension = b''
+        self.prev_orientation: Optional[int] = None
         self.init_frame(valid=False)
 
     def shut_down(self):
         "Request showdown of this *LiveViewReceiver* thread."
         self.running = False
+        try:
+            self.wakeup_send.send(b'\0')
+        except OSError:
+            pass # receiver has already ended
 
     def receive_packets(self, port: int) -> None:
         """
@@ -58,24 +205,54 @@ class LiveViewReceiver:
         :param port: port to listen to for RTP packages from the camera
         :type port: int
         """
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock, \
+             self.wakeup_recv, self.wakeup_send:
             sock.bind(("", port))
-            sock.settimeout(1) # A timeout terminates the loop below.
-            while True:
-                # read packet from socket
+            sock.setblocking(False) # We wait in select() below.
+
+            # A large receive buffer avoids losing packets, and with them
+            # entire frames, while this thread is not scheduled. The kernel
+            # may limit the size, e.g. to net.core.rmem_max on Linux.
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                self.RECV_BUFFER_SIZE)
+            except OSError:
+                pass
+
+            # On Linux receive all queued packets with a single system call.
+            try:
+                recv_mmsg: Optional[RecvMMsg] = RecvMMsg(sock)
+            except OSError:
+                recv_mmsg = None
+                # Elsewhere read the queued packets one at a time, each into
+                # its own slot of a reused buffer.
+                view = memoryview(bytearray(64 * 4096))
+                slots = [view[i:i+4096] for i in range(0, len(view), 4096)]
+
+            while self.running:
+                # Wait for packets or shut_down(), then read packets.
                 try:
-                    packet = sock.recv(4096)
-                except Exception as e:
-                    if 'timed out' in str(e):
-                        if self.running:
-                            # Not yet shutting down, keep going.
-                            continue
+                    ready = select.select([sock, self.wakeup_recv], [], [])[0]
+                    if self.wakeup_recv in ready:
+                        break
+                    if recv_mmsg is None:
+                        packets = []
+                        for slot in slots:
+                            try:
+                                packets.append(slot[:sock.recv_into(slot)])
+                            except BlockingIOError:
+                                break
                     else:
-                        print("Error reading liveview:", str(e))
+                        packets = recv_mmsg.receive()
+                except BlockingIOError:
+                    continue
+                except Exception as e:
+                    print("Error reading liveview:", str(e))
                     break
-                self.process_packet(packet)
+                for packet in packets:
+                    self.process_packet(packet)
 
-    def decode_RTP(self, packet: bytes) -> Tuple[int, int, bytes]:
+    def decode_RTP(self, packet: bytes) -> Tuple[int, int, memoryview]:
         """
         Decodes an RTP packet stores extension in *self.extension* and extracts
         marker, sequence number, and payload.
@@ -83,23 +260,28 @@ class LiveViewReceiver:
         Based on: https://en.wikipedia.org/wiki/Real-time_Transport_Protocol
 
         :param packet: packet received from camera consisting of JPEG image and RTP entension
-        :type packet: *bytes*
-        :returns: triple consisting of *marker*, *sequence_number*, and *payload*
+        :type packet: *bytes* or *memoryview*
+        :returns: triple consisting of *marker*, *sequence_number*, and *payload*; *marker* is non-zero if set, *payload* is a *memoryview* into *packet*
         """
-        version = packet[0] >> 6
+        # Slices of a memoryview do not copy the packet.
+        packet = memoryview(packet)
+        byte0, byte1, sequence_number = _RTP_HEADER.unpack_from(packet)
+
+        # Fast path for most packets: version 2, no padding, no extension,
+        # and no CSRC; only the first packet of a frame has an extension.
+        if byte0 == 0x80:
+            return byte1 & 128, sequence_number, packet[12:]
+
+        version = byte0 >> 6
         assert version == 2
 
-        padding = bool(packet[0] & 32)
-        extension = bool(packet[0] & 16)
-        CSRC_count = packet[0] & 15
-        marker = bool(packet[1] & 128)
-        sequence_number = (packet[2] << 8) + packet[3]
+        padding = byte0 & 32
+        extension = byte0 & 16
+        CSRC_count = byte0 & 15
+        marker = byte1 & 128
         '''
-        payload_type = packet[1] & 127
-        time_stamp = (packet[4] << 24) + (packet[5] << 16) + \
-                     (packet[6] << 8) + packet[7]
-        SSRC_identifier = (packet[8] << 24) + (packet[9] << 16) + \
-                          (packet[10] << 8) + packet[11]
+        payload_type = byte1 & 127
+        time_stamp, SSRC_identifier = struct.unpack_from('>II', packet, 4)
         '''
 
         # Remove padding if needed.
@@ -109,10 +291,11 @@ class LiveViewReceiver:
         # Extract payload, save extension.
         if extension:
             start = 14+4*CSRC_count
-            extension_header_length = (packet[start] << 8) + packet[start+1]
+            extension_header_length, = \
+                _RTP_EXTENSION_LENGTH.unpack_from(packet, start)
             start += 2
             size = 4*extension_header_length
-            self.extension = packet[start:start+size]
+            self.extension = bytes(packet[start:start+size])
             payload = packet[start+size:]
         else:
             payload = packet[12+4*CSRC_count:]
@@ -127,7 +310,7 @@ class LiveViewReceiver:
         :type valid: bool
         """
         self.assembling_frame = valid
-        self.frame = b''
+        self.frame = bytearray() # payloads are appended in place
         self.extension = b''
 
     def process_packet(self, packet: bytes) -> None:
@@ -146,14 +329,15 @@ class LiveViewReceiver:
 
         # Assemble payloads into frames.
         if self.assembling_frame:
-            self.frame += payload
             if (self.prev_sequence_number + 1) % 65536 != sequence_number:
                 # Invalidate frame due to out of sequence packet.
                 self.init_frame(valid=False)
+            else:
+                self.frame += payload
         self.prev_sequence_number = sequence_number
         if marker:
             if self.frame:
-                self.process_frame(self.frame)
+                self.process_frame(bytes(self.frame))
             self.init_frame()
 
     def process_frame(self, frame: bytes) -> None:
@@ -164,11 +348,37 @@ class LiveViewReceiver:
         :param frame: frame received from camera
         :type frame: *bytes*
         """
-        if frame[:2] == self.JPEG_START and frame[-2:] == self.JPEG_END:
-            while self.img_queue.qsize() >= self.MAX_QUEUE_SIZE:
-                # Take oldest frame from queue to make room.
-                self.img_queue.get()
-            self.img_queue.put(self.JPEGandExtension(frame, self.extension))
+        if frame.startswith(self.JPEG_START) and frame.endswith(self.JPEG_END):
+            # Frames are decoded by the gui, and only if they are shown; this
+            # thread only assembles frames so that it keeps up with the socket.
+            if self.extension != self.prev_extension:
+                self.prev_extension = self.extension
+                self.prev_orientation = self.get_orientation(self.extension)
+            self.img_queue.put(self.JPEGandExtension(frame, self.extension,
+                                                     self.prev_orientation))
+
+    @staticmethod
+    def get_orientation(extension: bytes) -> Optional[int]:
+        """
+        Get orientation from RTP extension. Its values are the same as in EXIF:
+        1 for 0°, 3 for 180°, 6 for 90° clockwise, and 8 for 270° clockwise.
+
+        :param extension: RTP extension
+        :type extension: bytes
+        :returns: 1, 3. 6, 8, or *None*.
+        """
+        idx = 0
+        while idx < len(extension):
+            func_id, length = _RTP_EXTENSION_ENTRY.unpack_from(extension, idx)
+            idx += 4
+
+            if func_id == 4: # orientation
+                orientation = extension[idx+3]
+                return orientation if orientation in (1, 3, 6, 8) else None
+
+            idx += 4 * length
+        assert idx == len(extension)
+        return None
 
 
 ##############################################################################
@@ -195,7 +405,7 @@ class LiveViewWindow:
         cur_val : int
         "current value, index into list of strings"
         variable: tkinter.IntVar
-        "variable being watched for changes"
+        "variable of the property's radiobuttons"
 
     UPDATE_INTERVAL = 25
     "The queue is checked every this many milliseconds for a new frame."
@@ -204,18 +414,20 @@ class LiveViewWindow:
         self.power_off = False
         self.camera = camera
         self.port = port
-        self.img_queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.img_queue = FrameQueue(LiveViewReceiver.MAX_QUEUE_SIZE)
         self.window = tkinter.Tk()
         self.width = self.height = None
-        if 'model' in camera.get_camera_info():
-            self.window.title(camera.get_camera_info()['model'])
+        camera_info = camera.get_camera_info()
+        if camera_info and 'model' in camera_info:
+            self.window.title(camera_info['model'])
         else:
             self.window.title("LiveView")
 
         # Select largest entry in lvqty_list that still fits our screen.
         self.lvqty_list = ['0640x0480']
-        if 'switch_cammode' in camera.get_commands():
-            args = camera.get_commands()['switch_cammode'].args
+        commands = camera.get_commands()
+        if 'switch_cammode' in commands:
+            args = commands['switch_cammode'].args
             if args is not None and 'mode' in args:
                 args1 = args['mode']
                 if args1 is not None and 'rec' in args1:
@@ -230,11 +442,10 @@ class LiveViewWindow:
                 self.lvqty_cur = i
         self.lvqty_var = tkinter.IntVar()
         self.lvqty_var.set(self.lvqty_cur)
-        self.lvqty_var.trace_add('write', self.on_lvqty)
 
         # Collect camera properties for Settings menu.
-        self.camprop_info = {}
-        camera.send_command('switch_cammode', mode='rec')
+        self.camprop_info: List[LiveViewWindow.CamPropInfo] = []
+        camera.switch_cammode(camera.CamMode.RECORD)
         cam_props = camera.xml_query('get_camprop', com='desc',
                                      propname='desclist')
         if isinstance(cam_props, list):
@@ -247,10 +458,9 @@ class LiveViewWindow:
                     continue
                 variable = tkinter.IntVar()
                 variable.set(index)
-                variable.trace_add('write', self.on_camprop)
-                self.camprop_info[str(variable)] = \
-                    self.CamPropInfo(prop['propname'], values, index, variable)
-        camera.send_command('switch_cammode', mode='play')
+                self.camprop_info.append(
+                    self.CamPropInfo(prop['propname'], values, index, variable))
+        camera.switch_cammode(camera.CamMode.PLAY)
 
         # Add menu bar.
         self.menubar = tkinter.Menu(self.window)
@@ -269,17 +479,20 @@ class LiveViewWindow:
         self.sizemenu = tkinter.Menu(self.viewmenu, tearoff=0)
         for value, label in enumerate(self.lvqty_list):
             self.sizemenu.add_radiobutton(label=label, value=value,
-                                          variable=self.lvqty_var)
+                                          variable=self.lvqty_var,
+                                          command=self.on_lvqty)
         self.viewmenu.add_cascade(label="Size", menu=self.sizemenu)
         self.menubar.add_cascade(label="View", menu=self.viewmenu)
 
         # Settings
         self.campropmenu = tkinter.Menu(self.menubar, tearoff=0)
-        for camprop in self.camprop_info.values():
+        for camprop in self.camprop_info:
             menu = tkinter.Menu(self.campropmenu, tearoff=0)
             for value, label in enumerate(camprop.values):
                 menu.add_radiobutton(label=label, value=value,
-                                     variable=camprop.variable)
+                                     variable=camprop.variable,
+                                     command=functools.partial(self.on_camprop,
+                                                               camprop))
             self.campropmenu.add_cascade(label=camprop.name, menu=menu)
         self.menubar.add_cascade(label="Settings", menu=self.campropmenu)
         self.window.config(menu=self.menubar)
@@ -311,41 +524,34 @@ class LiveViewWindow:
         self.window.after(self.UPDATE_INTERVAL, self.check_update_image)
         self.window.mainloop()
 
-        # Stop camera broadcasting liveview. When the liveview stops, the
-        # read on the UDP socket times out and the thread ends.
+        # Stop camera broadcasting liveview and end the receiver thread.
         udp_client.shut_down()
         self.camera.stop_liveview()
         thread.join()
 
         if self.power_off:
-            self.camera.send_command('switch_cammode', mode='play')
+            self.camera.switch_cammode(self.camera.CamMode.PLAY)
             self.camera.send_command('exec_pwoff')
 
     def take_pic(self) -> None:
         "Take a picture."
         self.camera.take_picture()
 
-    def on_lvqty(self, *args) -> None:
-        """
-        Called when *self.lvqty_var* is written to.
-
-        :param args: ignored
-        """
+    def on_lvqty(self) -> None:
+        "Called when a size is selected in the View menu."
         if self.lvqty_cur != self.lvqty_var.get():
             self.lvqty_cur = self.lvqty_var.get()
             self.camera.stop_liveview()
             self.camera.start_liveview(port=self.port,
                                        lvqty=self.lvqty_list[self.lvqty_cur])
 
-    def on_camprop(self, var_name: str, *dummy) -> None:
+    def on_camprop(self, camprop: 'LiveViewWindow.CamPropInfo') -> None:
         """
-        Called when a camprop variable is written to."
+        Called when a value is selected in the Settings menu.
 
-        :param var_name: camera property name
-        :type var_name: str
-        :param dummy: ignored
+        :param camprop: camera property whose value was selected
+        :type camprop: *LiveViewWindow.CamPropInfo*
         """
-        camprop = self.camprop_info[var_name]
         if camprop.cur_val != camprop.variable.get():
             camprop.cur_val = camprop.variable.get()
             self.camera.set_camprop(camprop.name,
@@ -364,16 +570,14 @@ class LiveViewWindow:
             raise TimeoutError("Timeout while waiting for imagedata from camera. Maybe you need to check your "
                                "firewall settings for incoming UDP traffic (from 192.168.0.10).") from e
 
-        orientation = self.get_orientation(jpeg_and_extension.extension)
-        if orientation is None or orientation == 1:
+        # Frames replaced in the queue by newer ones are never decoded.
+        orientation = jpeg_and_extension.orientation
+        if orientation not in _ROTATIONS:
             return ImageTk.PhotoImage(data=jpeg_and_extension.jpeg)
         with io.BytesIO(jpeg_and_extension.jpeg) as file:
             img = Image.open(file)
             img.load()
-        img = img.transpose(Image.ROTATE_180 if orientation == 3
-                            else Image.ROTATE_90 if orientation == 8
-                            else Image.ROTATE_270)
-        return ImageTk.PhotoImage(img)
+        return ImageTk.PhotoImage(img.transpose(_ROTATIONS[orientation]))
 
     def check_update_image(self) -> None:
         """
@@ -397,26 +601,14 @@ class LiveViewWindow:
 
     def get_orientation(self, extension: bytes) -> Optional[int]:
         """
-        Get orientation from RTP extension. Its values are the same as in EXIF:
-        1 for 0°, 3 for 180°, 6 for 90° clockwise, and 8 for 270° clockwise.
+        Get orientation from RTP extension, see
+        *LiveViewReceiver.get_orientation*.
 
         :param extension: RTP extension
         :type extension: bytes
         :returns: 1, 3. 6, 8, or *None*.
         """
-        idx = 0
-        while idx < len(extension):
-            func_id = (extension[idx] << 8) + extension[idx+1]
-            length  = 4 * ((extension[idx+2] << 8) + extension[idx+3])
-            idx += 4
-
-            if func_id == 4: # orientation
-                orientation = extension[idx+3]
-                return orientation if orientation in [1, 3, 6, 8] else None
-
-            idx += length
-        assert idx == len(extension)
-        return None
+        return LiveViewReceiver.get_orientation(extension)
 
     def set_clock(self):
         """
@@ -445,13 +637,12 @@ def main() -> None:
                         help=f"UPD port for liveview (default: {PORT}).")
     args = parser.parse_args()
 
-    # Connect to camera.
-    camera = OlympusCamera()
-
-    # Report camera model.
-    camera.report_model()
+    # Connect to camera; the connections are closed on exit.
+    with OlympusCamera() as camera:
+        # Report camera model.
+        camera.report_model()
 
-    LiveViewWindow(camera, args.port)
+        LiveViewWindow(camera, args.port)
 
 
 if __name__ == '__main__':
@@ -1,4 +1,5 @@
-import argparse, os, sys
+import argparse, functools, operator, os, sys
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from typing import List
 
@@ -44,9 +45,10 @@ def read_log(fn: str) -> List[TrackPoint]:
 
             # verify checksum
 
-            cksum = 8
-            for c in line[:line.rfind(',')]:
-                cksum ^= ord(c)
+            cksum = functools.reduce(operator.xor,
+                                     line[:line.rfind(',')].encode('latin-1',
+                                                                   'replace'),
+                                     8)
 
             if f'*{cksum:2X}' != components[-1]:
                 print(f"Checksum error: '*{cksum:2X}' vs. '{components[-1]}' "
@@ -69,13 +71,16 @@ def read_log(fn: str) -> List[TrackPoint]:
                 print(f"Invalid line {line_no}: '{line}'.", file=sys.stderr)
                 continue
 
+            # ddmm.mmmm and dddmm.mmmm to degrees
             assert lat[4] == '.'
-            latitude = float(lat[:2]) + float(lat[2:]) / 60
+            degrees, minutes = divmod(float(lat), 100)
+            latitude = degrees + minutes / 60
             if NorS == 'S':
                 latitude = -latitude
 
             assert lon[5] == '.'
-            longitude = float(lon[:3]) + float(lon[3:]) / 60
+            degrees, minutes = divmod(float(lon), 100)
+            longitude = degrees + minutes / 60
             if EorW == 'W':
                 longitude = -longitude
 
@@ -98,30 +103,48 @@ def write_gpx(fn: str, track: List[TrackPoint]) -> None:
     :type track: *List[TrackPoint]*
     :returns: list of *TrackPoint*
     """
+    parts = [
+        '<?xml version="1.0" encoding="utf-8" standalone="yes"?>\n'
+        '<gpx version="1.1" creator="log2gpx.py https://github.com/'
+        'joergmlpts/olympus-wifi" '
+        'xmlns="http://www.topografix.com/GPX/1/1" '
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:'
+        'schemaLocation="http://www.topografix.com/GPX/1/1 http://www.'
+        'topografix.com/GPX/1/1/gpx.xsd">\n'
+        '<trk>\n'
+        f'  <name>{os.path.splitext(os.path.split(fn)[1])[0]}</name>\n'
+        '  <trkseg>\n'
+    ]
+
+    parts.extend(f'    <trkpt lat="{point.latitude:.6f}" '
+                 f'lon="{point.longitude:.6f}">\n'
+                 f'      <ele>{point.elevation}</ele>\n'
+                 f'      <time>{point.iso_time}</time>\n'
+                 '    </trkpt>\n' for point in track)
+
+    parts.append('  </trkseg>\n'
+                 '</trk>\n'
+                 '</gpx>\n')
+
+    # Write the whole document at once.
     with open(fn, 'wt') as f:
-        print('<?xml version="1.0" encoding="utf-8" standalone="yes"?>',
-              file=f)
-        print('<gpx version="1.1" creator="log2gpx.py https://github.com/'
-              'joergmlpts/olympus-wifi" '
-              'xmlns="http://www.topografix.com/GPX/1/1" '
-              'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:'
-              'schemaLocation="http://www.topografix.com/GPX/1/1 http://www.'
-              'topografix.com/GPX/1/1/gpx.xsd">', file=f)
-        print('<trk>', file=f)
-        print(f'  <name>{os.path.splitext(os.path.split(fn)[1])[0]}</name>',
-              file=f)
-        print('  <trkseg>', file=f)
-
-        for point in track:
-            print(f'    <trkpt lat="{point.latitude:.6f}" '
-                  f'lon="{point.longitude:.6f}">', file=f)
-            print(f'      <ele>{point.elevation}</ele>', file=f)
-            print(f'      <time>{point.iso_time}</time>', file=f)
-            print('    </trkpt>', file=f)
-
-        print('  </trkseg>', file=f)
-        print('</trk>', file=f)
-        print('</gpx>', file=f)
+        f.write(''.join(parts))
+
+def convert(fn: str) -> None:
+    """
+    Convert a GPS track from .LOG to .gpx format. The .gpx file is written
+    next to the .LOG file.
+
+    :param fn: File name of .LOG file.
+    :type fn: *str*
+    """
+    track = read_log(fn)
+    if len(track) == 0:
+        print(f"No GPS track found in '{fn}'.", file=sys.stderr)
+    else:
+        outfn = os.path.splitext(fn)[0] + '.gpx'
+        print(f"Converting '{fn} to '{outfn}'.")
+        write_gpx(outfn, track)
 
 def main() -> None:
     """
@@ -137,11 +160,8 @@ def main() -> None:
         :type fn: *str*
         :raises: *argparse.ArgumentTypeError* if *fn* is not a valid filename
         """
-        try:
-            with open(fn, 'rt') as f:
-                return fn
-        except:
-            pass
+        if os.path.isfile(fn) and os.access(fn, os.R_OK):
+            return fn
         raise argparse.ArgumentTypeError(f"File '{fn}' cannot be read.")
 
     parser = argparse.ArgumentParser()
@@ -149,14 +169,12 @@ def main() -> None:
                         help="Convert a GPS track from .LOG to .gpx format.")
     args = parser.parse_args()
 
-    for fn in args.log:
-        track = read_log(fn)
-        if len(track) == 0:
-            print(f"No GPS track found in '{fn}'.", file=sys.stderr)
-        else:
-            outfn = os.path.splitext(fn)[0] + '.gpx'
-            print(f"Converting '{fn} to '{outfn}'.")
-            write_gpx(outfn, track)
+    if len(args.log) == 1:
+        convert(args.log[0])
+    else:
+        # Convert several files in parallel, one process per CPU.
+        with ProcessPoolExecutor() as executor:
+            list(executor.map(convert, args.log))
 
 
 if __name__ == '__main__':
@@ -148,33 +148,32 @@ def main() -> None:
 
     args = parser.parse_args()
 
-    # Connect to camera.
-    camera = OlympusCamera()
+    # Connect to camera; the connections are closed on exit.
+    with OlympusCamera() as camera:
+        # Report camera model.
+        camera.report_model()
 
-    # Report camera model.
-    camera.report_model()
+        # Set camera's clock if requested.
+        if args.set_clock:
+            camera.set_clock()
 
-    # Set camera's clock if requested.
-    if args.set_clock:
-        camera.set_clock()
+        if args.cmd:
+            for cmd in args.cmd:
+                if user_command(camera, cmd):
+                    break
 
-    if args.cmd:
-        for cmd in args.cmd:
-            if user_command(camera, cmd):
-                break
+        if args.shoot:
+            camera.take_picture()
 
-    if args.shoot:
-        camera.take_picture()
+        if args.liveview:
+            LiveViewWindow(camera, args.port)
 
-    if args.liveview:
-        LiveViewWindow(camera, args.port)
+        if args.download:
+            download_photos(camera, args.output)
 
-    if args.download:
-        download_photos(camera, args.output)
-
-    # Turn camera off if requested.
-    if args.power_off:
-        camera.send_command('exec_pwoff')
+        # Turn camera off if requested.
+        if args.power_off:
+            camera.send_command('exec_pwoff')
 
 
 #################################